@@ -6,6 +6,7 @@ PostgreSQL, MySQL) in the future for production use.
 
 from langchain_core.messages import BaseMessage
 from langchain_community.chat_message_histories.sql import (
+    DefaultMessageConverter,
     SQLChatMessageHistory,
 )
 
@@ -17,10 +18,31 @@ class ChatHistory:
     Class to manage chat history using a SQL database, ith methods to get and
     add messages to the database, along with clearing the history for a
     specific session.
+
+    :param url: The URL of the database to store the chat history in.
+    :type url: str
     """
 
-    def __init__(self) -> None:
-        self._engine = create_engine(url="sqlite:///chat_history.db")
+    def __init__(self, url: str = "sqlite:///chat_history.db") -> None:
+        self._engine = create_engine(url=url)
+        # A single converter is shared by every history, as each converter
+        # declares a new SQLAlchemy model class, which is never released.
+        self._converter = DefaultMessageConverter(table_name="message_store")
+
+    def _history(self, session_id: str) -> SQLChatMessageHistory:
+        """
+        Get the SQL chat message history for a specific session.
+
+        :param session_id: The ID of the session to get the history for.
+        :type session_id: str
+        :return: The chat message history for the specified session.
+        :rtype: SQLChatMessageHistory
+        """
+        return SQLChatMessageHistory(
+            connection=self._engine,
+            session_id=session_id,
+            custom_message_converter=self._converter,
+        )
 
     def get_messages(self, session_id: str) -> list[BaseMessage]:
         """
@@ -31,10 +53,7 @@ class ChatHistory:
         :return: A list of messages for the specified session.
         :rtype: list[BaseMessage]
         """
-        return SQLChatMessageHistory(
-            connection=self._engine,
-            session_id=session_id,
-        ).get_messages()
+        return self._history(session_id=session_id).get_messages()
 
     def add_messages(
         self, session_id: str, messages: list[BaseMessage]
@@ -47,10 +66,7 @@ class ChatHistory:
         :param messages: The list of messages to add.
         :type messages: list[BaseMessage]
         """
-        SQLChatMessageHistory(
-            connection=self._engine,
-            session_id=session_id,
-        ).add_messages(messages=messages)
+        self._history(session_id=session_id).add_messages(messages=messages)
 
     def clear(self, session_id: str) -> None:
         """
@@ -59,7 +75,4 @@ class ChatHistory:
         :param session_id: The ID of the session to clear.
         :type session_id: str
         """
-        SQLChatMessageHistory(
-            connection=self._engine,
-            session_id=session_id,
-        ).clear()
+        self._history(session_id=session_id).clear()
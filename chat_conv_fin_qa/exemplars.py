@@ -0,0 +1,404 @@
+"""
+Module to select few-shot exemplars from the ConvFinQA training set. Questions
+and their programs are embedded as hashed word n-gram vectors, which are built
+once offline and cached to disk as NumPy arrays that are memory-mapped on load,
+so the index is not rebuilt on every startup.
+
+The vectors are almost entirely zeros, so they are stored sparse and
+feature-major (the indptr, indices and data arrays of a CSC matrix). A query
+only reads the entries of the hashed features present in the query, and
+selecting the top-k exemplars takes well under a millisecond on CPU.
+
+The cache records the settings the index was built with and a fingerprint of
+the training data, and is rebuilt if either has changed. The index can be
+built ahead of time using:
+```bash
+python3 -m chat_conv_fin_qa.exemplars
+```
+"""
+
+from typing import Any, Iterable
+from dataclasses import dataclass
+from pathlib import Path
+from textwrap import dedent
+import hashlib
+import json
+import re
+import zlib
+
+import numpy as np
+import numpy.typing as npt
+
+
+TRAIN_DATA_PATH = Path("data/train.json")
+INDEX_PATH = Path("exemplar_index")
+INDEX_ARRAYS = ("indptr", "indices", "data")
+# Increment when the layout or weighting of the index changes.
+INDEX_VERSION = 2
+N_FEATURES = 2**14
+NGRAM_RANGE = (1, 2)
+
+EXEMPLAR_TEMPLATE = dedent(
+    """
+    <example>
+    Question: {question}
+    Program: {program}
+    Answer: {answer}
+    </example>
+    """
+)
+
+FEW_SHOT_TEMPLATE = (
+    "Below are some examples of similar questions, along with the program "
+    "of operations used to calculate the answer:\n\n"
+    "<examples>{examples}</examples>\n\n"
+)
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?")
+
+
+@dataclass
+class Exemplar:
+    """
+    A single question from the training set, with the ID of the item it came
+    from and the program and answer used to solve it.
+    """
+
+    id: str
+    question: str
+    program: str
+    answer: str
+
+
+def _features(text: str) -> dict[int, float]:
+    """
+    Hash the word n-grams of the text into feature indices, weighted by
+    term frequency.
+
+    :param text: The text to hash.
+    :type text: str
+    :return: Mapping of feature index to count.
+    :rtype: dict[int, float]
+    """
+    tokens = _TOKEN_PATTERN.findall(text.lower())
+    features: dict[int, float] = {}
+    for n in range(NGRAM_RANGE[0], NGRAM_RANGE[1] + 1):
+        for start in range(len(tokens) - n + 1):
+            end = start + n
+            ngram = " ".join(tokens[start:end]).encode()
+            index = zlib.crc32(ngram) % N_FEATURES
+            features[index] = features.get(index, 0.0) + 1.0
+    return features
+
+
+def _array_path(index_path: Path, name: str) -> Path:
+    return index_path.with_name(f"{index_path.name}.{name}.npy")
+
+
+def _metadata_path(index_path: Path) -> Path:
+    return index_path.with_name(f"{index_path.name}.json")
+
+
+def _settings() -> dict[str, Any]:
+    """
+    Get the settings the index is built with, which must match for a cached
+    index to be used.
+
+    :return: The index settings.
+    :rtype: dict[str, Any]
+    """
+    return {
+        "version": INDEX_VERSION,
+        "n_features": N_FEATURES,
+        "ngram_range": list(NGRAM_RANGE),
+        "token_pattern": _TOKEN_PATTERN.pattern,
+    }
+
+
+def _fingerprint(data_path: Path) -> dict[str, Any]:
+    """
+    Fingerprint the training data by its path, size and hash, to check a
+    cached index was built from the same data.
+
+    :param data_path: Path to the training data.
+    :type data_path: Path
+    :return: The fingerprint of the training data.
+    :rtype: dict[str, Any]
+    """
+    with open(data_path, "rb") as f:
+        digest = hashlib.file_digest(f, "sha256").hexdigest()
+    return {
+        "path": str(data_path.resolve()),
+        "size": data_path.stat().st_size,
+        "sha256": digest,
+    }
+
+
+class ExemplarIndex:
+    """
+    Index of exemplars from the training set, with methods to build the index
+    and cache it to disk, load it from the cache, and query for the most
+    similar exemplars to a question.
+
+    :param exemplars: The exemplars in the index, in row order.
+    :type exemplars: list[Exemplar]
+    :param arrays: The indptr, indices and data arrays of the sparse
+        feature-major matrix of exemplar vectors.
+    :type arrays: dict[str, npt.NDArray[Any]]
+    :param idf: The inverse document frequency of each feature.
+    :type idf: npt.NDArray[np.float32]
+    :param data_fingerprint: Fingerprint of the training data the index was
+        built from.
+    :type data_fingerprint: dict[str, Any]
+    """
+
+    def __init__(
+        self,
+        exemplars: list[Exemplar],
+        arrays: dict[str, npt.NDArray[Any]],
+        idf: npt.NDArray[np.float32],
+        data_fingerprint: dict[str, Any],
+    ) -> None:
+        self.exemplars = exemplars
+        self.data_fingerprint = data_fingerprint
+        # Entries for feature f are indptr[f]:indptr[f + 1] of the indices
+        # (exemplar rows) and data (normalised TF-IDF weights) arrays.
+        self._indptr = arrays["indptr"]
+        self._indices = arrays["indices"]
+        self._data = arrays["data"]
+        self._idf = idf
+
+    @classmethod
+    def build(cls, data_path: Path = TRAIN_DATA_PATH) -> "ExemplarIndex":
+        """
+        Build the index from the training data, using TF-IDF weighted hashed
+        n-gram vectors of each question and its program.
+
+        :param data_path: Path to the training data.
+        :type data_path: Path
+        :return: The built exemplar index.
+        :rtype: ExemplarIndex
+        """
+        with open(data_path, "r") as f:
+            data: list[dict[str, Any]] = json.load(f)
+
+        exemplars = [
+            Exemplar(
+                id=str(item.get("id", position)),
+                question=item["qa"]["question"],
+                program=item["qa"]["program"],
+                answer=str(item["qa"]["answer"]),
+            )
+            for position, item in enumerate(data)
+            if "qa" in item
+            and "question" in item["qa"]
+            and "program" in item["qa"]
+            and "answer" in item["qa"]
+        ]
+
+        row_features = [
+            _features(f"{exemplar.question} {exemplar.program}")
+            for exemplar in exemplars
+        ]
+        features = np.fromiter(
+            (index for row in row_features for index in row), dtype=np.intp
+        )
+        rows = np.repeat(
+            np.arange(len(exemplars), dtype=np.int32),
+            [len(row) for row in row_features],
+        )
+        weights = np.fromiter(
+            (count for row in row_features for count in row.values()),
+            dtype=np.float32,
+        )
+
+        # Each feature appears at most once per row, so the number of entries
+        # per feature is also its document frequency.
+        document_frequency = np.bincount(features, minlength=N_FEATURES)
+        idf = (
+            np.log((1 + len(exemplars)) / (1 + document_frequency)) + 1
+        ).astype(np.float32)
+        weights *= idf[features]
+        norms = np.sqrt(
+            np.bincount(rows, weights=weights**2, minlength=len(exemplars))
+        )
+        weights /= np.maximum(norms[rows], 1e-12).astype(np.float32)
+
+        order = np.argsort(features, kind="stable")
+        indptr = np.zeros(N_FEATURES + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(document_frequency)
+
+        return cls(
+            exemplars=exemplars,
+            arrays={
+                "indptr": indptr,
+                "indices": rows[order],
+                "data": weights[order],
+            },
+            idf=idf,
+            data_fingerprint=_fingerprint(data_path),
+        )
+
+    def save(self, index_path: Path = INDEX_PATH) -> None:
+        """
+        Save the index to disk, with the sparse vectors stored as NumPy arrays
+        and the exemplars and IDF weights stored alongside as JSON.
+
+        :param index_path: Path prefix to save the index files to.
+        :type index_path: Path
+        """
+        np.save(_array_path(index_path, "indptr"), self._indptr)
+        np.save(_array_path(index_path, "indices"), self._indices)
+        np.save(_array_path(index_path, "data"), self._data)
+        with open(_metadata_path(index_path), "w") as f:
+            json.dump(
+                {
+                    "settings": _settings(),
+                    "data": self.data_fingerprint,
+                    "idf": self._idf.tolist(),
+                    "exemplars": [
+                        exemplar.__dict__ for exemplar in self.exemplars
+                    ],
+                },
+                f,
+            )
+
+    @classmethod
+    def load(cls, index_path: Path = INDEX_PATH) -> "ExemplarIndex":
+        """
+        Load the index from disk, memory-mapping the sparse vectors.
+
+        :param index_path: Path prefix the index files were saved to.
+        :type index_path: Path
+        :raises ValueError: If the index was built with different settings.
+        :return: The loaded exemplar index.
+        :rtype: ExemplarIndex
+        """
+        with open(_metadata_path(index_path), "r") as f:
+            metadata: dict[str, Any] = json.load(f)
+
+        if metadata.get("settings") != _settings():
+            raise ValueError("Exemplar index was built with other settings.")
+
+        return cls(
+            exemplars=[
+                Exemplar(**exemplar) for exemplar in metadata["exemplars"]
+            ],
+            arrays={
+                name: np.load(_array_path(index_path, name), mmap_mode="r")
+                for name in INDEX_ARRAYS
+            },
+            idf=np.asarray(metadata["idf"], dtype=np.float32),
+            data_fingerprint=metadata["data"],
+        )
+
+    @classmethod
+    def load_or_build(
+        cls,
+        data_path: Path = TRAIN_DATA_PATH,
+        index_path: Path = INDEX_PATH,
+    ) -> "ExemplarIndex":
+        """
+        Load the index from the cache if it was built with the same settings
+        from the same training data, otherwise build the index and save it to
+        the cache.
+
+        :param data_path: Path to the training data.
+        :type data_path: Path
+        :param index_path: Path prefix of the cached index files.
+        :type index_path: Path
+        :return: The exemplar index.
+        :rtype: ExemplarIndex
+        """
+        if _metadata_path(index_path).exists() and all(
+            _array_path(index_path, name).exists() for name in INDEX_ARRAYS
+        ):
+            try:
+                index = cls.load(index_path=index_path)
+            except ValueError:
+                pass
+            else:
+                if index.data_fingerprint == _fingerprint(data_path):
+                    return index
+
+        index = cls.build(data_path=data_path)
+        index.save(index_path=index_path)
+        return index
+
+    def query(
+        self, question: str, k: int = 3, exclude: Iterable[str] = ()
+    ) -> list[Exemplar]:
+        """
+        Get the top-k exemplars most similar to the question, by cosine
+        similarity of the TF-IDF weighted hashed n-gram vectors. Exemplars
+        with no n-grams in common with the question are never returned, and
+        exemplars from excluded items are skipped, so the answer to an item
+        from the training set is not leaked into its own prompt.
+
+        :param question: The question to find exemplars for.
+        :type question: str
+        :param k: The number of exemplars to return.
+        :type k: int
+        :param exclude: IDs of the items to exclude exemplars from.
+        :type exclude: Iterable[str]
+        :return: Up to k of the most similar exemplars, most similar first.
+        :rtype: list[Exemplar]
+        """
+        features = _features(question)
+        if k < 1 or not features or not self.exemplars:
+            return []
+
+        similarities = np.zeros(len(self.exemplars), dtype=np.float32)
+        for feature, count in features.items():
+            start = self._indptr[feature]
+            end = self._indptr[feature + 1]
+            similarities[self._indices[start:end]] += (
+                count * self._idf[feature] * self._data[start:end]
+            )
+
+        excluded = set(exclude)
+        n_top = min(k + len(excluded), len(self.exemplars))
+        top = np.argpartition(-similarities, n_top - 1)[:n_top]
+        top = top[np.argsort(-similarities[top])]
+        return [
+            self.exemplars[i]
+            for i in top
+            if similarities[i] > 0 and self.exemplars[i].id not in excluded
+        ][:k]
+
+    def format_exemplars(
+        self, question: str, k: int = 3, exclude: Iterable[str] = ()
+    ) -> str:
+        """
+        Format the top-k exemplars for the question to be included in the
+        system prompt.
+
+        :param question: The question to find exemplars for.
+        :type question: str
+        :param k: The number of exemplars to include.
+        :type k: int
+        :param exclude: IDs of the items to exclude exemplars from.
+        :type exclude: Iterable[str]
+        :return: The formatted exemplars, or an empty string if none found.
+        :rtype: str
+        """
+        exemplars = self.query(question=question, k=k, exclude=exclude)
+        if not exemplars:
+            return ""
+
+        return FEW_SHOT_TEMPLATE.format(
+            examples="".join(
+                EXEMPLAR_TEMPLATE.format(
+                    question=exemplar.question,
+                    program=exemplar.program,
+                    answer=exemplar.answer,
+                )
+                for exemplar in exemplars
+            )
+        )
+
+
+if __name__ == "__main__":
+    built_index = ExemplarIndex.build()
+    built_index.save()
+    print(f"Built exemplar index with {len(built_index.exemplars)} exemplars")
@@ -8,19 +8,34 @@ The evaluation is done using a structured output model, which allows for
 validation of the scores returned by the model and accounting for any verbose
 answers which have numerical answers, negatives, differences etc.
 
+Multi-turn dialogues can also be evaluated in conversation mode, where every
+turn of a dialogue is asked in a single session with the document context
+built once per dialogue and the system prompt cached across turns. Accuracy is
+reported per turn, along with the latency and the tokens read from and written
+to the prompt cache for each dialogue. Prompts shorter than the minimum
+cacheable length of the model are not cached, which is reported as a dialogue
+with no cache reads.
+
+Answers can be scored in batches, where many answer and reference pairs are
+sent to the judge model in a single structured output call keyed by item ID.
+Any items missing from the batched response are re-scored individually.
+
 This could be extended to use other evaluation metrics such as BLEU or ROUGE
 scores, but for now we are using a simple scoring system from 0 to 100.
 """
 
 from typing import Any
+from argparse import ArgumentParser
 from asyncio import run
+from itertools import islice
+from time import perf_counter
 import json
 from uuid import uuid4
 from textwrap import dedent
 
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 
-from chat_conv_fin_qa.mcp.client.main import MCPClient, SYSTEM_PROMPT_TEMPLATE
+from chat_conv_fin_qa.mcp.client.main import MCPClient
 from chat_conv_fin_qa.model.anthropic import AnthropicModel
 
 
@@ -42,6 +57,15 @@ class Score(BaseModel):
     score: int
 
 
+class ItemScore(BaseModel):
+    id: str
+    score: int
+
+
+class BatchScore(BaseModel):
+    scores: list[ItemScore]
+
+
 EVALUATION_PROMPT = dedent(
     """
     You are an exam checker. you will be given a question and an answer, along
@@ -60,17 +84,147 @@ EVALUATION_PROMPT = dedent(
     """
 )
 
+BATCH_EVALUATION_PROMPT = dedent(
+    """
+    You are an exam checker. you will be given a list of items, each with an
+    ID, an answer and the correct reference answer. Your task is to evaluate
+    each answer and give it a score from 0 to 100. 0 means the answer is
+    completely wrong, and 100 means the answer is completely correct. If the
+    answer is partially correct, give a score between 0 and 100.
+
+    Give exactly one score for every item, using the ID of the item.
+
+    <items>
+    {items}
+    </items>
+
+    Please use the schema below to give your scores:
+
+    <schema>{schema}</schema>
+    """
+)
+
+BATCH_ITEM_TEMPLATE = (
+    '<item id="{id}">'
+    "<answer>{answer}</answer>"
+    "<reference_answer>{reference}</reference_answer>"
+    "</item>"
+)
+
 
 class EvaluateClient(MCPClient):
     """
     Client to evaluate the MCP client using a set of questions and answers.
+
+    :param judge_batch_size: Number of answers to score in a single judge
+        call, where 1 scores every answer individually.
+    :type judge_batch_size: int
+    :param few_shot_k: Number of similar exemplars from the training set to
+        include in the system prompt, where 0 disables few-shot prompting.
+    :type few_shot_k: int
+    :raises ValueError: If the judge batch size is less than 1.
     """
 
-    def __init__(self) -> None:
-        super().__init__()
-        self._model_structured = AnthropicModel().with_structured_output(
+    def __init__(
+        self, judge_batch_size: int = 10, few_shot_k: int = 0
+    ) -> None:
+        super().__init__(few_shot_k=few_shot_k)
+        if judge_batch_size < 1:
+            raise ValueError("Judge batch size must be at least 1.")
+
+        judge = AnthropicModel()
+        self._judge_batch_size = judge_batch_size
+        self._model_structured = judge.with_structured_output(
             output_schema=Score.model_json_schema()
         )
+        self._model_structured_batch = judge.with_structured_output(
+            output_schema=BatchScore.model_json_schema()
+        )
+
+    async def _score(self, answer: str, reference: str) -> int | None:
+        """
+        Score a single answer against the reference answer using the judge
+        model.
+
+        :param answer: The answer given by the model.
+        :type answer: str
+        :param reference: The reference answer from the dataset.
+        :type reference: str
+        :return: The score from 0 to 100, or None if the judge response could
+            not be validated.
+        :rtype: int | None
+        """
+        structured_response = await self._model_structured.ainvoke(
+            input=EVALUATION_PROMPT.format(
+                answer=answer,
+                reference=reference,
+                schema=Score.model_json_schema(),
+            )
+        )
+        try:
+            return Score.model_validate(structured_response).score
+        except ValidationError:
+            return None
+
+    async def _score_batch(
+        self, items: dict[str, tuple[str, str]]
+    ) -> dict[str, int | None]:
+        """
+        Score a batch of answers against their reference answers in a single
+        judge call. Any items missing from the judge response are re-scored
+        individually.
+
+        :param items: Mapping of item ID to a tuple of answer and reference.
+        :type items: dict[str, tuple[str, str]]
+        :return: Mapping of item ID to score, or None if the score could not
+            be validated.
+        :rtype: dict[str, int | None]
+        """
+        if len(items) == 1:
+            item_id, (answer, reference) = next(iter(items.items()))
+            return {item_id: await self._score(answer, reference)}
+
+        structured_response = await self._model_structured_batch.ainvoke(
+            input=BATCH_EVALUATION_PROMPT.format(
+                items="\n".join(
+                    BATCH_ITEM_TEMPLATE.format(
+                        id=item_id, answer=answer, reference=reference
+                    )
+                    for item_id, (answer, reference) in items.items()
+                ),
+                schema=BatchScore.model_json_schema(),
+            )
+        )
+        scores: dict[str, int | None] = {}
+        try:
+            batch_score = BatchScore.model_validate(structured_response)
+            for item_score in batch_score.scores:
+                if item_score.id in items:
+                    scores[item_score.id] = item_score.score
+        except ValidationError:
+            print("Batch score validation error")
+
+        for item_id, (answer, reference) in items.items():
+            if item_id not in scores:
+                print(f"Re-scoring missing item {item_id} individually")
+                scores[item_id] = await self._score(answer, reference)
+
+        return scores
+
+    async def _print_scores(self, items: dict[str, tuple[str, str]]) -> None:
+        """
+        Score a batch of answers and print the score for each item.
+
+        :param items: Mapping of item ID to a tuple of answer and reference.
+        :type items: dict[str, tuple[str, str]]
+        """
+        scores = await self._score_batch(items)
+        for item_id, score in scores.items():
+            if score is None:
+                print(f"Item {item_id}: Score validation error")
+            else:
+                print(f"Item {item_id}: Score: {score}")
+        print("=" * 79)
 
     async def evaluate(self) -> None:
         """
@@ -84,7 +238,8 @@ class EvaluateClient(MCPClient):
             data: list[dict[str, Any]] = json.load(f)
 
         cnt = 0
-        for item in data:
+        pending: dict[str, tuple[str, str]] = {}
+        for position, item in enumerate(data):
             if (
                 "qa" not in item
                 or "question" not in item["qa"]
@@ -92,44 +247,202 @@ class EvaluateClient(MCPClient):
             ):
                 continue
 
-            self._system_prompt = SYSTEM_PROMPT_TEMPLATE.format(
+            item_id = str(item.get("id", position))
+            self._system_prompt = self.build_system_prompt(
                 context=CONTEXT_TEMPLATE.format(
                     pre_text=item["pre_text"],
                     post_text=item["post_text"],
                     table=item["table"],
-                )
+                ),
+                query=item["qa"]["question"],
+                exclude={item_id},
             )
+            print(f"Item {item_id}")
             print(f"Question: {item['qa']['question']}")
             response = await self.invoke(item["qa"]["question"], uuid4().hex)
             print("-" * 79)
             print(f"AI Answer: {response.content}")
             print(f"Expected Answer: {item['qa']['answer']}")
+            print("=" * 79)
+
+            pending[item_id] = (str(response.content), item["qa"]["answer"])
+            if len(pending) >= self._judge_batch_size:
+                await self._print_scores(pending)
+                pending = {}
+
+            cnt += 1
+            if cnt > 10:
+                break
 
-            structred_response = self._model_structured.invoke(
-                input=EVALUATION_PROMPT.format(
-                    answer=response.content,
-                    reference=item["qa"]["answer"],
-                    schema=Score.model_json_schema(),
+        if pending:
+            await self._print_scores(pending)
+
+    async def _score_turns(
+        self,
+        answers: dict[str, tuple[str, str]],
+        turn_scores: dict[int, list[int]],
+    ) -> None:
+        """
+        Score a batch of turn answers and record the score for each turn.
+
+        :param answers: Mapping of turn ID, formatted as item ID and turn
+            number separated by a slash, to a tuple of answer and reference.
+        :type answers: dict[str, tuple[str, str]]
+        :param turn_scores: Mapping of turn number to the scores recorded for
+            that turn, which is updated in place.
+        :type turn_scores: dict[int, list[int]]
+        """
+        scores = await self._score_batch(answers)
+        for turn_id, score in scores.items():
+            if score is None:
+                print(f"Turn {turn_id}: Score validation error")
+                continue
+            print(f"Turn {turn_id}: Score: {score}")
+            turn = int(turn_id.rsplit("/", 1)[1])
+            turn_scores.setdefault(turn, []).append(score)
+        print("=" * 79)
+
+    async def evaluate_conversations(self) -> None:
+        """
+        Evaluate the MCP client on whole conversations from the ConvFinQA
+        dataset. Every turn of a dialogue is asked in a single session, so
+        later turns can refer back to earlier ones, with the document context
+        built once per dialogue. Accuracy is reported per turn, along with
+        the latency and prompt cache usage of each dialogue. The system prompt
+        is only marked for caching while evaluating conversations, where it
+        is reused across turns. Answers are collected across dialogues and
+        scored in batches of the judge batch size.
+        """
+        cache_system_prompt = self._cache_system_prompt
+        self._cache_system_prompt = True
+        try:
+            await self._evaluate_conversations()
+        finally:
+            self._cache_system_prompt = cache_system_prompt
+
+    async def _evaluate_conversations(self) -> None:
+        """
+        Ask and score every turn of the dialogues, then report the accuracy
+        per turn, the mean dialogue latency and the prompt cache usage.
+        """
+        with open("data/train.json", "r") as f:
+            data: list[dict[str, Any]] = json.load(f)
+
+        turn_scores: dict[int, list[int]] = {}
+        latencies: list[float] = []
+        pending: dict[str, tuple[str, str]] = {}
+        uncached = 0
+        self.usage.clear()
+        cnt = 0
+        for position, item in enumerate(data):
+            annotation = item.get("annotation", {})
+            if (
+                "dialogue_break" not in annotation
+                or "exe_ans_list" not in annotation
+            ):
+                continue
+
+            item_id = str(item.get("id", position))
+            questions: list[str] = annotation["dialogue_break"]
+            references: list[Any] = annotation["exe_ans_list"]
+            if len(questions) != len(references):
+                print(
+                    f"Skipping dialogue {item_id}: {len(questions)} questions "
+                    f"but {len(references)} reference answers"
+                )
+                continue
+
+            context = CONTEXT_TEMPLATE.format(
+                pre_text=item["pre_text"],
+                post_text=item["post_text"],
+                table=item["table"],
+            )
+            self._system_prompt = self.build_system_prompt(
+                context=context, query=questions[0], exclude={item_id}
+            )
+            session_id = uuid4().hex
+            print(f"Dialogue {item_id}")
+
+            usage_before = self.usage.copy()
+            start = perf_counter()
+            for turn, (question, reference) in enumerate(
+                zip(questions, references)
+            ):
+                print(f"Turn {turn} Question: {question}")
+                response = await self.invoke(question, session_id)
+                print("-" * 79)
+                print(f"AI Answer: {response.content}")
+                print(f"Expected Answer: {reference}")
+                print("-" * 79)
+                pending[f"{item_id}/{turn}"] = (
+                    str(response.content),
+                    str(reference),
                 )
+            latency = perf_counter() - start
+            latencies.append(latency)
+            usage = self.usage - usage_before
+            print(f"Dialogue latency: {latency:.2f}s")
+            print(
+                f"Cache read tokens: {usage['cache_read']}, "
+                f"cache creation tokens: {usage['cache_creation']}"
             )
-            try:
-                score = Score.model_validate(structred_response)
-                print(f"Score: {score.score}")
-            except Exception:
-                print("Score validation error")
+            if len(questions) > 1 and usage["cache_read"] == 0:
+                uncached += 1
+                print(
+                    "System prompt was not read from the cache, it may be "
+                    "shorter than the minimum cacheable length"
+                )
             print("=" * 79)
 
+            while len(pending) >= self._judge_batch_size:
+                batch_ids = list(islice(pending, self._judge_batch_size))
+                await self._score_turns(
+                    {turn_id: pending.pop(turn_id) for turn_id in batch_ids},
+                    turn_scores,
+                )
+
             cnt += 1
             if cnt > 10:
                 break
 
+        if pending:
+            await self._score_turns(pending, turn_scores)
+
+        for turn, scores in sorted(turn_scores.items()):
+            print(
+                f"Turn {turn}: mean score {sum(scores) / len(scores):.1f} "
+                f"over {len(scores)} dialogues"
+            )
+        if latencies:
+            print(
+                "Mean dialogue latency: "
+                f"{sum(latencies) / len(latencies):.2f}s"
+            )
+        print(
+            f"Input tokens: {self.usage['input_tokens']}, "
+            f"cache read tokens: {self.usage['cache_read']}, "
+            f"cache creation tokens: {self.usage['cache_creation']}, "
+            f"dialogues without cache reads: {uncached}"
+        )
+
 
 async def main() -> None:
     """
     Main function to run the evaluation client.
     """
+    parser = ArgumentParser(description="Evaluate the MCP client.")
+    parser.add_argument(
+        "--conversation",
+        action="store_true",
+        help="evaluate whole dialogues in a single session per dialogue",
+    )
+    args = parser.parse_args()
+
     async with EvaluateClient() as client:
-        await client.evaluate()
+        if args.conversation:
+            await client.evaluate_conversations()
+        else:
+            await client.evaluate()
 
 
 if __name__ == "__main__":
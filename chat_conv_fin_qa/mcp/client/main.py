@@ -5,7 +5,10 @@ chat to the model, which can invoke tools to answer questions as required.
 """
 
 from types import TracebackType
-from typing import Any
+from collections import Counter
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Any, Iterable
 from typing_extensions import Self
 from contextlib import AsyncExitStack
 from asyncio import run
@@ -23,7 +26,9 @@ from langchain_core.messages import (
 from mcp.types import TextContent
 
 from chat_conv_fin_qa.chat_history import ChatHistory
+from chat_conv_fin_qa.exemplars import ExemplarIndex
 from chat_conv_fin_qa.model.anthropic import AnthropicModel
+from chat_conv_fin_qa.utils.profiling import REPORT_PATH, SessionProfiler
 
 DEFAULT_CONTEXT = """
  [
@@ -94,15 +99,51 @@ class MCPClient:
     Main client class for the MCP client. This class handles the connection
     to the MCP server, manages the chat history, and provides methods for
     interacting with the server. The client can invoke tools and handle
-    responses from the server."""
+    responses from the server.
+
+    :param few_shot_k: Number of similar exemplars from the training set to
+        include in the system prompt, where 0 disables few-shot prompting.
+    :type few_shot_k: int
+    :param cache_system_prompt: Whether to mark the system prompt for prompt
+        caching, so the context is not reprocessed by the model on every call
+        in a session.
+    :type cache_system_prompt: bool
+    :param profile_every: Number of turns between memory profiling snapshots,
+        where 0 disables profiling. The report is written when the client is
+        closed.
+    :type profile_every: int
+    :param profile_report_path: Path to write the memory profiling report to.
+    :type profile_report_path: Path
+    """
 
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        few_shot_k: int = 0,
+        cache_system_prompt: bool = False,
+        profile_every: int = 0,
+        profile_report_path: Path = REPORT_PATH,
+    ) -> None:
         self.chat_history = ChatHistory()
         self.sessions: list[ClientSession] = []
         self.exit_stack = AsyncExitStack()
         self.tool_sessions: dict[str, ClientSession] = {}
         self._model = AnthropicModel()
         self._system_prompt: str
+        self.usage: Counter[str] = Counter()
+        self._few_shot_k = few_shot_k
+        self._cache_system_prompt = cache_system_prompt
+        self._exemplar_index = (
+            ExemplarIndex.load_or_build() if few_shot_k > 0 else None
+        )
+        self._profiler = (
+            SessionProfiler(
+                every_n_turns=profile_every, report_path=profile_report_path
+            )
+            if profile_every > 0
+            else None
+        )
+        if self._profiler is not None:
+            self._profiler.start()
 
     async def __aenter__(self) -> Self:
         await self.connect_to_servers()
@@ -148,13 +189,77 @@ class MCPClient:
 
         self._model.bind_tools(all_tools)
 
+    def build_system_prompt(
+        self, context: str, query: str, exclude: Iterable[str] = ()
+    ) -> str:
+        """
+        Build the system prompt for the given context, including the most
+        similar exemplars to the query if few-shot prompting is enabled.
+
+        :param context: The context to answer the query against.
+        :type context: str
+        :param query: The query used to select exemplars.
+        :type query: str
+        :param exclude: IDs of the training set items to exclude exemplars
+            from, such as the item being evaluated.
+        :type exclude: Iterable[str]
+        :return: The system prompt.
+        :rtype: str
+        """
+        system_prompt = SYSTEM_PROMPT_TEMPLATE.format(context=context)
+        if self._exemplar_index is not None:
+            system_prompt += self._exemplar_index.format_exemplars(
+                question=query, k=self._few_shot_k, exclude=exclude
+            )
+        return system_prompt
+
+    def system_message(self) -> SystemMessage:
+        """
+        Get the system message for the current system prompt, marked for
+        prompt caching if enabled.
+
+        :return: The system message.
+        :rtype: SystemMessage
+        """
+        if self._cache_system_prompt:
+            return SystemMessage(
+                content=[
+                    {
+                        "type": "text",
+                        "text": self._system_prompt,
+                        "cache_control": {"type": "ephemeral"},
+                    }
+                ]
+            )
+        return SystemMessage(content=self._system_prompt)
+
+    def _record_usage(self, response: AIMessage) -> None:
+        """
+        Add the token usage reported for a model response to the usage
+        totals, including the input tokens read from and written to the
+        prompt cache.
+
+        :param response: The response from the model.
+        :type response: AIMessage
+        """
+        usage = response.usage_metadata
+        if usage is None:
+            return
+
+        self.usage["input_tokens"] += usage["input_tokens"]
+        self.usage["output_tokens"] += usage["output_tokens"]
+        details = usage.get("input_token_details", {})
+        self.usage["cache_read"] += details.get("cache_read", 0)
+        self.usage["cache_creation"] += details.get("cache_creation", 0)
+
     async def invoke(self, query: str, session_id: str) -> AIMessage:
         """
         Invoke the model with the given query and session ID. This method
         sends the query to the model, receives the response, and handles
         any tool calls that may be required to answer the query. The
-        chat history is updated with the new messages, and the response
-        is returned.
+        chat history is updated with the new messages, the token usage of
+        every model call is added to the usage totals, and the response is
+        returned.
 
         :param query: The query to send to the model.
         :type query: str
@@ -163,12 +268,15 @@ class MCPClient:
         :return: The response from the model.
         :rtype: AIMessage
         """
-        messages = [
-            SystemMessage(content=self._system_prompt)
-        ] + self.chat_history.get_messages(session_id)
-        new_messages: list[BaseMessage] = [HumanMessage(content=query)]
-        response = self._model.chat(messages + new_messages)
-        new_messages.append(response)
+        # A single list is extended in place through the tool loop, rather
+        # than concatenating the history and new messages on every call.
+        messages: list[BaseMessage] = [self.system_message()]
+        messages.extend(self.chat_history.get_messages(session_id))
+        n_history = len(messages)
+        messages.append(HumanMessage(content=query))
+        response = await self._model.achat(messages)
+        self._record_usage(response)
+        messages.append(response)
 
         while len(response.tool_calls) > 0:
             if (
@@ -193,21 +301,24 @@ class MCPClient:
                 )
                 print(f"Result: {print_result}")
 
-                new_messages.append(
+                messages.append(
                     ToolMessage(
                         content=result.content,  # type: ignore[arg-type]
                         name=tool_call["name"],
                         tool_call_id=tool_call["id"],
                     )
                 )
-            response = self._model.chat(messages + new_messages)
-            new_messages.append(response)
+            response = await self._model.achat(messages)
+            self._record_usage(response)
+            messages.append(response)
 
         print(f"AI: {response.content}")
 
         self.chat_history.add_messages(
-            messages=new_messages, session_id=session_id
+            messages=messages[n_history:], session_id=session_id
         )
+        if self._profiler is not None:
+            self._profiler.record_turn()
 
         return response
 
@@ -229,7 +340,6 @@ class MCPClient:
             context = DEFAULT_CONTEXT
             print(context)
 
-        self._system_prompt = SYSTEM_PROMPT_TEMPLATE.format(context=context)
         session_id = uuid4().hex
         while True:
             try:
@@ -237,6 +347,9 @@ class MCPClient:
                 if query.lower() == "q":
                     break
 
+                self._system_prompt = self.build_system_prompt(
+                    context=context, query=query
+                )
                 await self.invoke(
                     query=query,
                     session_id=session_id,
@@ -246,13 +359,24 @@ class MCPClient:
 
     async def close(self) -> None:
         await self.exit_stack.aclose()
+        if self._profiler is not None:
+            self._profiler.stop()
 
 
 async def main() -> None:
     """
     Main function to run the MCP client.
     """
-    async with MCPClient() as client:
+    parser = ArgumentParser(description="Chat with the MCP client.")
+    parser.add_argument(
+        "--profile-every",
+        type=int,
+        default=0,
+        help="profile memory every N turns, writing memory_profile.txt",
+    )
+    args = parser.parse_args()
+
+    async with MCPClient(profile_every=args.profile_every) as client:
         await client.run()
 
 
@@ -6,6 +6,18 @@ chat model wrapper.
 from langchain_anthropic.chat_models import ChatAnthropic
 
 from chat_conv_fin_qa.model.base import BaseModel
+from chat_conv_fin_qa.model.rate_limit import RateLimitConfig, RateLimiter
+
+# Limits shared by all instances, which default to the lowest usage tier and
+# can be raised with ANTHROPIC_* environment variables.
+ANTHROPIC_RATE_LIMITER = RateLimiter(
+    RateLimitConfig.from_env(
+        "ANTHROPIC",
+        requests_per_minute=50,
+        input_tokens_per_minute=50_000,
+        output_tokens_per_minute=10_000,
+    )
+)
 
 
 class AnthropicModel(BaseModel):
@@ -18,5 +30,7 @@ class AnthropicModel(BaseModel):
         temperature=0.3,
         max_tokens=1024,
         timeout=60,
-        max_retries=3,
+        # Retries are handled by the shared rate limiter.
+        max_retries=0,
     )
+    _rate_limiter = ANTHROPIC_RATE_LIMITER
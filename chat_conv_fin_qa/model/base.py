@@ -5,26 +5,144 @@ for specific models, such as OpenAI or Anthropic. The base class provides
 methods for sending messages to the model, invoking the model with a
 prompt, and binding tools to the model. The class also provides a method
 for setting the output schema for the model.
+
+All calls to the model go through the rate limiter for the provider, if one
+is set, which is shared by every instance of the model wrapper in the process.
+The limiter handles retries, so wrappers which set one should disable the
+retries of the underlying chat model. A different limiter can be passed to an
+instance of the model wrapper.
 """
 
 from typing import Any, Optional
+from time import sleep
+import asyncio
 
 from pydantic import BaseModel as PydanticBaseModel
 from langchain_core.messages import BaseMessage, AIMessage
-from langchain_core.runnables import Runnable
+from langchain_core.runnables import Runnable, RunnableLambda
 from langchain_core.language_models import LanguageModelInput
 from langchain_core.language_models.chat_models import BaseChatModel
 
+from chat_conv_fin_qa.model.rate_limit import (
+    DEFAULT_OUTPUT_TOKENS,
+    RateLimiter,
+    estimate_tokens,
+)
+
 
 class BaseModel:
     """
     Base class for model wrappers. This class provides a common interface
     for interacting with different models.
+
+    :param rate_limiter: Rate limiter to use instead of the one shared by the
+        model wrapper class, e.g. with the limits of a higher usage tier.
+    :type rate_limiter: Optional[RateLimiter]
     """
 
     _model: BaseChatModel
     _tools_bound: bool = False
     _tool_model: Optional[Runnable[LanguageModelInput, BaseMessage]]
+    _rate_limiter: Optional[RateLimiter] = None
+
+    def __init__(self, rate_limiter: Optional[RateLimiter] = None) -> None:
+        if rate_limiter is not None:
+            self._rate_limiter = rate_limiter
+
+    def _output_tokens(self) -> int:
+        """
+        Estimate the number of output tokens for a call, using the maximum
+        number of tokens the model is configured to generate.
+
+        :return: The estimated number of output tokens.
+        :rtype: int
+        """
+        max_tokens = getattr(self._model, "max_tokens", None)
+        if isinstance(max_tokens, int):
+            return max_tokens
+        return DEFAULT_OUTPUT_TOKENS
+
+    def _call(self, runnable: Runnable[Any, Any], model_input: Any) -> Any:
+        """
+        Invoke a runnable within the rate limits of the provider, retrying
+        with backoff on rate limit, overloaded and transient errors.
+
+        :param runnable: The model runnable to invoke.
+        :type runnable: Runnable[Any, Any]
+        :param model_input: The input to the runnable.
+        :type model_input: Any
+        :raises BaseException: The error from the last attempt, if the call
+            failed and is not retried.
+        :return: The output of the runnable.
+        :rtype: Any
+        """
+        limiter = self._rate_limiter
+        if limiter is None:
+            return runnable.invoke(input=model_input)
+
+        input_tokens = estimate_tokens(model_input)
+        output_tokens = self._output_tokens()
+        attempt = 0
+        while True:
+            limiter.acquire(input_tokens, output_tokens)
+            try:
+                result = runnable.invoke(input=model_input)
+            except BaseException as e:
+                delay = limiter.release(
+                    input_tokens, output_tokens, None, e, attempt
+                )
+                if delay is None:
+                    raise
+            else:
+                limiter.release(input_tokens, output_tokens, result, None)
+                return result
+            sleep(delay)
+            attempt += 1
+
+    async def _acall(
+        self, runnable: Runnable[Any, Any], model_input: Any
+    ) -> Any:
+        """
+        Asynchronously invoke a runnable within the rate limits of the
+        provider, retrying with backoff on rate limit, overloaded and
+        transient errors.
+
+        :param runnable: The model runnable to invoke.
+        :type runnable: Runnable[Any, Any]
+        :param model_input: The input to the runnable.
+        :type model_input: Any
+        :raises BaseException: The error from the last attempt, if the call
+            failed and is not retried.
+        :return: The output of the runnable.
+        :rtype: Any
+        """
+        limiter = self._rate_limiter
+        if limiter is None:
+            return await runnable.ainvoke(input=model_input)
+
+        input_tokens = estimate_tokens(model_input)
+        output_tokens = self._output_tokens()
+        attempt = 0
+        while True:
+            await limiter.acquire_async(input_tokens, output_tokens)
+            try:
+                result = await runnable.ainvoke(input=model_input)
+            except BaseException as e:
+                delay = limiter.release(
+                    input_tokens, output_tokens, None, e, attempt
+                )
+                if delay is None:
+                    raise
+            else:
+                limiter.release(input_tokens, output_tokens, result, None)
+                return result
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def _chat_model(self) -> Runnable[LanguageModelInput, BaseMessage]:
+        if self._tools_bound and self._tool_model:
+            return self._tool_model
+        return self._model
 
     def chat(self, messages: list[BaseMessage]) -> AIMessage:
         """
@@ -37,10 +155,25 @@ class BaseModel:
         :return: The model's response message.
         :rtype: AIMessage
         """
-        if self._tools_bound and self._tool_model:
-            result = self._tool_model.invoke(input=messages)
+        result = self._call(self._chat_model(), messages)
+
+        if isinstance(result, AIMessage):
+            return result
         else:
-            result = self._model.invoke(input=messages)
+            raise ValueError("Model response is not an AIMessage.")
+
+    async def achat(self, messages: list[BaseMessage]) -> AIMessage:
+        """
+        Method to asynchronously send a list of messages to the model and
+        generate the next response based on the messages.
+
+        :param messages: List of messages to send to the model.
+        :type messages: list[BaseMessage]
+        :raises ValueError: If the model response is not an AIMessage.
+        :return: The model's response message.
+        :rtype: AIMessage
+        """
+        result = await self._acall(self._chat_model(), messages)
 
         if isinstance(result, AIMessage):
             return result
@@ -57,10 +190,7 @@ class BaseModel:
         :return: The model's response.
         :rtype: str
         """
-        if self._tools_bound and self._tool_model:
-            result = self._tool_model.invoke(input=prompt).content
-        else:
-            result = self._model.invoke(input=prompt).content
+        result = self._call(self._chat_model(), prompt).content
 
         if isinstance(result, str):
             return result
@@ -81,11 +211,30 @@ class BaseModel:
         self, output_schema: dict[str, Any]
     ) -> Runnable[LanguageModelInput, dict[str, Any] | PydanticBaseModel]:
         """
-        Method to set the output schema for the model.
+        Method to set the output schema for the model. Calls to the returned
+        runnable are rate limited in the same way as other calls to the model.
 
         :param output_schema: The output schema to set.
         :type output_schema: dict[str, Any]
         :return: A runnable model with the specified output schema.
         :rtype: Runnable[LanguageModelInput, dict | PydanticBaseModel]
         """
-        return self._model.with_structured_output(output_schema)
+        structured_model = self._model.with_structured_output(output_schema)
+
+        def invoke(
+            model_input: LanguageModelInput,
+        ) -> dict[str, Any] | PydanticBaseModel:
+            result: dict[str, Any] | PydanticBaseModel = self._call(
+                structured_model, model_input
+            )
+            return result
+
+        async def ainvoke(
+            model_input: LanguageModelInput,
+        ) -> dict[str, Any] | PydanticBaseModel:
+            result: dict[str, Any] | PydanticBaseModel = await self._acall(
+                structured_model, model_input
+            )
+            return result
+
+        return RunnableLambda(func=invoke, afunc=ainvoke)
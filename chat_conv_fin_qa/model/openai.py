@@ -6,6 +6,17 @@ chat model wrapper.
 from langchain_openai.chat_models import ChatOpenAI
 
 from chat_conv_fin_qa.model.base import BaseModel
+from chat_conv_fin_qa.model.rate_limit import RateLimitConfig, RateLimiter
+
+# Limits shared by all instances, which default to the lowest usage tier and
+# can be raised with OPENAI_* environment variables.
+OPENAI_RATE_LIMITER = RateLimiter(
+    RateLimitConfig.from_env(
+        "OPENAI",
+        requests_per_minute=500,
+        tokens_per_minute=30_000,
+    )
+)
 
 
 class AnthropicModel(BaseModel):
@@ -18,5 +29,7 @@ class AnthropicModel(BaseModel):
         temperature=0.3,
         max_tokens=1024,  # type: ignore[call-arg]
         timeout=60,
-        max_retries=3,
+        # Retries are handled by the shared rate limiter.
+        max_retries=0,
     )
+    _rate_limiter = OPENAI_RATE_LIMITER
@@ -0,0 +1,433 @@
+"""
+Module for limiting the rate of calls to model providers. Limits are shared by
+every model wrapper for the same provider in the process, so the client and
+the judge model in the evaluation do not compete blindly for the same quota.
+
+Requests, input tokens and output tokens are each limited by a token bucket,
+and the limiter has both sync and async methods to wait for capacity. For
+providers with a single combined token limit, input and output tokens share
+one bucket. The
+number of requests in flight is limited by an adaptive concurrency limit,
+which is halved when the provider responds with a rate limit or overloaded
+error and increased additively on success (AIMD).
+
+The limiter is the only retry policy for rate limited calls, so model wrappers
+which use it should disable the retries of the underlying provider client.
+Transient connection and server errors are also retried, without changing the
+concurrency limit.
+
+The limits default to the lowest usage tier of each provider, and can be
+raised with environment variables named after the config fields, prefixed
+with the provider name, e.g. `ANTHROPIC_REQUESTS_PER_MINUTE`.
+"""
+
+from typing import Any, Optional
+from dataclasses import dataclass, fields
+from threading import Condition, Lock
+from time import monotonic, sleep
+import asyncio
+import os
+
+from langchain_core.messages import AIMessage, BaseMessage
+
+RATE_LIMIT_STATUS_CODES = (429, 529)
+RETRYABLE_STATUS_CODES = (408, 409, 500, 502, 503, 504)
+RETRYABLE_ERROR_NAMES = ("APIConnectionError", "APITimeoutError")
+DEFAULT_OUTPUT_TOKENS = 1024
+
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    """
+    Check whether an error from a provider is a rate limit or overloaded
+    error, using the status code set by the Anthropic and OpenAI clients.
+
+    :param error: The error raised by the provider.
+    :type error: BaseException
+    :return: True if the error is a rate limit or overloaded error.
+    :rtype: bool
+    """
+    return getattr(error, "status_code", None) in RATE_LIMIT_STATUS_CODES
+
+
+def is_retryable_error(error: BaseException) -> bool:
+    """
+    Check whether an error from a provider should be retried, which includes
+    rate limit, overloaded, transient server and connection errors.
+
+    :param error: The error raised by the provider.
+    :type error: BaseException
+    :return: True if the request should be retried.
+    :rtype: bool
+    """
+    return (
+        is_rate_limit_error(error)
+        or getattr(error, "status_code", None) in RETRYABLE_STATUS_CODES
+        or any(
+            cls.__name__ in RETRYABLE_ERROR_NAMES
+            for cls in type(error).__mro__
+        )
+    )
+
+
+def estimate_tokens(model_input: Any) -> int:
+    """
+    Estimate the number of tokens in a model input, using roughly 4
+    characters per token.
+
+    :param model_input: A prompt or list of messages.
+    :type model_input: Any
+    :return: The estimated number of tokens.
+    :rtype: int
+    """
+    if isinstance(model_input, list):
+        return sum(estimate_tokens(message) for message in model_input)
+    if isinstance(model_input, BaseMessage):
+        return estimate_tokens(model_input.content)
+    return len(str(model_input)) // 4 + 1
+
+
+class TokenBucket:
+    """
+    Token bucket which refills continuously at a fixed rate up to its
+    capacity. Callers reserve capacity up front, which may take the bucket
+    into debt, and then wait until the debt has been refilled, so waiting
+    callers are served in the order they reserved.
+
+    :param capacity: The maximum capacity of the bucket.
+    :type capacity: float
+    :param refill_per_second: The capacity refilled per second.
+    :type refill_per_second: float
+    """
+
+    def __init__(self, capacity: float, refill_per_second: float) -> None:
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self._available = capacity
+        self._updated = monotonic()
+        self._lock = Lock()
+
+    def _refill(self) -> None:
+        now = monotonic()
+        self._available = min(
+            self.capacity,
+            self._available + (now - self._updated) * self.refill_per_second,
+        )
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        """
+        Reserve capacity from the bucket without waiting.
+
+        :param amount: The amount of capacity to reserve.
+        :type amount: float
+        :return: The number of seconds to wait before the reservation can be
+            used.
+        :rtype: float
+        """
+        with self._lock:
+            self._refill()
+            self._available -= min(amount, self.capacity)
+            if self._available >= 0:
+                return 0.0
+            return -self._available / self.refill_per_second
+
+    def adjust(self, amount: float) -> None:
+        """
+        Take capacity from the bucket, or return it if negative, without
+        waiting. Used to correct reservations once actual usage is known.
+
+        :param amount: The amount of capacity to take.
+        :type amount: float
+        """
+        with self._lock:
+            self._refill()
+            self._available = min(self.capacity, self._available - amount)
+
+
+class AdaptiveConcurrencyLimit:
+    """
+    Limit on the number of requests in flight, which is increased by one for
+    each window of successful requests and multiplied by the decrease factor
+    on a rate limit or overloaded error.
+
+    :param initial_limit: The initial number of requests in flight allowed.
+    :type initial_limit: float
+    :param min_limit: The minimum the limit can be decreased to.
+    :type min_limit: float
+    :param max_limit: The maximum the limit can be increased to.
+    :type max_limit: float
+    :param decrease_factor: Factor to multiply the limit by on a rate limit
+        or overloaded error.
+    :type decrease_factor: float
+    :param poll_interval: Seconds between checks for a free slot when
+        waiting asynchronously.
+    :type poll_interval: float
+    """
+
+    def __init__(
+        self,
+        initial_limit: float = 4,
+        min_limit: float = 1,
+        max_limit: float = 32,
+        decrease_factor: float = 0.5,
+        poll_interval: float = 0.01,
+    ) -> None:
+        self.limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self.poll_interval = poll_interval
+        self.in_flight = 0
+        self._condition = Condition()
+
+    def _try_acquire(self) -> bool:
+        with self._condition:
+            if self.in_flight < max(int(self.limit), 1):
+                self.in_flight += 1
+                return True
+            return False
+
+    def acquire(self) -> None:
+        """
+        Wait until a request can be sent within the concurrency limit.
+        """
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self.in_flight < max(int(self.limit), 1)
+            )
+            self.in_flight += 1
+
+    async def acquire_async(self) -> None:
+        """
+        Wait asynchronously until a request can be sent within the
+        concurrency limit.
+        """
+        while not self._try_acquire():
+            await asyncio.sleep(self.poll_interval)
+
+    def abandon(self) -> None:
+        """
+        Release a request slot without updating the limit, for a request
+        which was never sent or which failed with an error other than a rate
+        limit or overloaded error.
+        """
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def release(self, success: bool) -> None:
+        """
+        Release a request slot and update the limit based on the outcome.
+
+        :param success: True if the request succeeded, False if it failed
+            with a rate limit or overloaded error.
+        :type success: bool
+        """
+        with self._condition:
+            self.in_flight -= 1
+            if success:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            else:
+                self.limit = max(
+                    self.min_limit, self.limit * self.decrease_factor
+                )
+            self._condition.notify_all()
+
+
+@dataclass
+class RateLimitConfig:
+    """
+    Per minute limits for a provider, along with the concurrency limits and
+    retries for retryable errors. Token limits are either separate limits on
+    input and output tokens, or a combined limit on all tokens, which takes
+    precedence if set.
+    """
+
+    requests_per_minute: float
+    input_tokens_per_minute: Optional[float] = None
+    output_tokens_per_minute: Optional[float] = None
+    tokens_per_minute: Optional[float] = None
+    initial_concurrency: float = 4
+    max_concurrency: float = 32
+    max_retries: int = 3
+    retry_backoff: float = 1.0
+
+    @classmethod
+    def from_env(cls, prefix: str, **defaults: Any) -> "RateLimitConfig":
+        """
+        Create a config from environment variables named after the fields
+        with the given prefix, e.g. `ANTHROPIC_REQUESTS_PER_MINUTE`, falling
+        back to the defaults for any which are not set.
+
+        :param prefix: The prefix of the environment variables.
+        :type prefix: str
+        :param **defaults: Default values of the config fields.
+        :type **defaults: Any
+        :return: The rate limit config.
+        :rtype: RateLimitConfig
+        """
+        values = dict(defaults)
+        for field in fields(cls):
+            value = os.environ.get(f"{prefix}_{field.name.upper()}")
+            if value is not None:
+                values[field.name] = (
+                    int(value) if field.name == "max_retries" else float(value)
+                )
+        return cls(**values)
+
+
+class RateLimiter:
+    """
+    Rate limiter for a model provider, combining token buckets for requests,
+    input tokens and output tokens with an adaptive concurrency limit.
+
+    :param config: The limits for the provider.
+    :type config: RateLimitConfig
+    :raises ValueError: If neither a combined token limit nor both input and
+        output token limits are set.
+    """
+
+    def __init__(self, config: RateLimitConfig) -> None:
+        self.config = config
+        self.requests = TokenBucket(
+            capacity=config.requests_per_minute,
+            refill_per_second=config.requests_per_minute / 60,
+        )
+        if config.tokens_per_minute is not None:
+            # Input and output tokens count towards the same limit.
+            self.input_tokens = self.output_tokens = TokenBucket(
+                capacity=config.tokens_per_minute,
+                refill_per_second=config.tokens_per_minute / 60,
+            )
+        elif (
+            config.input_tokens_per_minute is not None
+            and config.output_tokens_per_minute is not None
+        ):
+            self.input_tokens = TokenBucket(
+                capacity=config.input_tokens_per_minute,
+                refill_per_second=config.input_tokens_per_minute / 60,
+            )
+            self.output_tokens = TokenBucket(
+                capacity=config.output_tokens_per_minute,
+                refill_per_second=config.output_tokens_per_minute / 60,
+            )
+        else:
+            raise ValueError(
+                "Either a combined token limit or both input and output "
+                "token limits must be set."
+            )
+        self.concurrency = AdaptiveConcurrencyLimit(
+            initial_limit=config.initial_concurrency,
+            max_limit=config.max_concurrency,
+        )
+
+    def _reserve(self, input_tokens: int, output_tokens: int) -> float:
+        return max(
+            self.requests.reserve(1),
+            self.input_tokens.reserve(input_tokens),
+            self.output_tokens.reserve(output_tokens),
+        )
+
+    def _refund(self, input_tokens: int, output_tokens: int) -> None:
+        self.requests.adjust(-1)
+        self.input_tokens.adjust(-input_tokens)
+        self.output_tokens.adjust(-output_tokens)
+
+    def acquire(self, input_tokens: int, output_tokens: int) -> None:
+        """
+        Wait until a request with the estimated number of input and output
+        tokens can be sent. If the wait is interrupted, the concurrency slot
+        and reserved capacity are returned.
+
+        :param input_tokens: The estimated number of input tokens.
+        :type input_tokens: int
+        :param output_tokens: The estimated number of output tokens.
+        :type output_tokens: int
+        :raises BaseException: If the wait is interrupted, e.g. by a
+            KeyboardInterrupt.
+        """
+        self.concurrency.acquire()
+        try:
+            sleep(self._reserve(input_tokens, output_tokens))
+        except BaseException:
+            self._refund(input_tokens, output_tokens)
+            self.concurrency.abandon()
+            raise
+
+    async def acquire_async(
+        self, input_tokens: int, output_tokens: int
+    ) -> None:
+        """
+        Wait asynchronously until a request with the estimated number of
+        input and output tokens can be sent. If the wait is cancelled, the
+        concurrency slot and reserved capacity are returned.
+
+        :param input_tokens: The estimated number of input tokens.
+        :type input_tokens: int
+        :param output_tokens: The estimated number of output tokens.
+        :type output_tokens: int
+        :raises BaseException: If the wait is cancelled, e.g. by an
+            asyncio.CancelledError.
+        """
+        await self.concurrency.acquire_async()
+        try:
+            await asyncio.sleep(self._reserve(input_tokens, output_tokens))
+        except BaseException:
+            self._refund(input_tokens, output_tokens)
+            self.concurrency.abandon()
+            raise
+
+    def release(
+        self,
+        input_tokens: int,
+        output_tokens: int,
+        result: Any,
+        error: BaseException | None,
+        attempt: int = 0,
+    ) -> float | None:
+        """
+        Release a request, correcting the reserved tokens with the actual
+        usage reported by the provider. Without reported usage, the estimates
+        are kept for a response and the output estimate is returned for a
+        failed request. The concurrency limit is increased on success and
+        decreased on a rate limit or overloaded error, and left unchanged on
+        any other error. Failed requests are retried with exponential backoff
+        on retryable errors, up to the maximum number of retries.
+
+        :param input_tokens: The estimated number of input tokens.
+        :type input_tokens: int
+        :param output_tokens: The estimated number of output tokens.
+        :type output_tokens: int
+        :param result: The model response, if the request succeeded.
+        :type result: Any
+        :param error: The error raised by the request, if it failed.
+        :type error: BaseException | None
+        :param attempt: The number of the attempt, starting at 0.
+        :type attempt: int
+        :return: The number of seconds to wait before retrying the request,
+            or None if it succeeded or should not be retried.
+        :rtype: float | None
+        """
+        if isinstance(result, AIMessage) and result.usage_metadata:
+            self.input_tokens.adjust(
+                result.usage_metadata["input_tokens"] - input_tokens
+            )
+            self.output_tokens.adjust(
+                result.usage_metadata["output_tokens"] - output_tokens
+            )
+        elif error is not None:
+            self.output_tokens.adjust(-output_tokens)
+        if error is None:
+            self.concurrency.release(success=True)
+        elif is_rate_limit_error(error):
+            self.concurrency.release(success=False)
+        else:
+            self.concurrency.abandon()
+
+        if (
+            not isinstance(error, Exception)
+            or not is_retryable_error(error)
+            or attempt >= self.config.max_retries
+        ):
+            return None
+        return float(self.config.retry_backoff * 2**attempt)
@@ -0,0 +1,178 @@
+"""
+Module to profile memory use and allocations in long-running chat sessions.
+When enabled, a tracemalloc snapshot is taken every N turns and compared to the
+previous snapshot, along with counts of live LangChain message objects and the
+peak resident memory of the process. The report is written when the profiler
+is stopped, or at exit if it was never stopped.
+"""
+
+from collections import Counter
+from pathlib import Path
+import atexit
+import gc
+import sys
+import tracemalloc
+
+from langchain_core.messages import BaseMessage
+
+REPORT_PATH = Path("memory_profile.txt")
+TOP_ALLOCATIONS = 10
+TRACEBACK_FRAMES = 5
+
+
+def count_messages() -> Counter[str]:
+    """
+    Count the live LangChain message objects by type.
+
+    :return: Counts of live message objects, keyed by class name.
+    :rtype: Counter[str]
+    """
+    # Check the method resolution order of the type rather than using
+    # isinstance, which would trigger the lazy loading of any proxy objects,
+    # or issubclass, which is slow for the abstract message classes.
+    return Counter(
+        type(obj).__name__
+        for obj in gc.get_objects()
+        if BaseMessage in type(obj).__mro__
+    )
+
+
+def peak_rss_mb() -> float | None:
+    """
+    Get the peak resident set size of the process in megabytes. This is
+    reported in bytes on macOS and in kilobytes on Linux, and is not
+    available on Windows.
+
+    :return: The peak resident set size in megabytes, or None if it is not
+        available on this platform.
+    :rtype: float | None
+    """
+    try:
+        # The resource module is only available on Unix, so is imported here
+        # to keep the profiler importable elsewhere.
+        import resource
+    except ImportError:
+        return None
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return max_rss / 1024**2
+    return max_rss / 1024
+
+
+def filtered_snapshot() -> tracemalloc.Snapshot:
+    """
+    Take a tracemalloc snapshot, excluding the allocations made by
+    tracemalloc itself.
+
+    :return: The filtered snapshot.
+    :rtype: tracemalloc.Snapshot
+    """
+    return tracemalloc.take_snapshot().filter_traces(
+        (tracemalloc.Filter(False, tracemalloc.__file__),)
+    )
+
+
+class SessionProfiler:
+    """
+    Profiler for memory use across the turns of long-running sessions, with
+    methods to start and stop profiling and record each turn.
+
+    :param every_n_turns: Number of turns between snapshots.
+    :type every_n_turns: int
+    :param report_path: Path to write the report to.
+    :type report_path: Path
+    """
+
+    def __init__(
+        self, every_n_turns: int = 100, report_path: Path = REPORT_PATH
+    ) -> None:
+        self.every_n_turns = every_n_turns
+        self.report_path = report_path
+        self.turns = 0
+        self.lines: list[str] = []
+        self._snapshot: tracemalloc.Snapshot | None = None
+        self._messages: Counter[str] = Counter()
+        self._running = False
+        self._started_tracing = False
+
+    def start(self) -> None:
+        """
+        Start tracing allocations, if not already being traced, and take the
+        baseline snapshot.
+        """
+        if self._running:
+            return
+
+        self._started_tracing = not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start(TRACEBACK_FRAMES)
+        self._running = True
+        self._snapshot = filtered_snapshot()
+        self._messages = count_messages()
+        atexit.register(self.stop)
+
+    def record_turn(self) -> None:
+        """
+        Record a completed turn, taking a snapshot every N turns.
+        """
+        if not self._running:
+            return
+
+        self.turns += 1
+        if self.turns % self.every_n_turns == 0:
+            self.take_snapshot()
+
+    def take_snapshot(self) -> None:
+        """
+        Take a snapshot and add the allocation and message count deltas
+        since the previous snapshot to the report.
+        """
+        gc.collect()
+        snapshot = filtered_snapshot()
+        messages = count_messages()
+        current, peak = tracemalloc.get_traced_memory()
+        peak_rss = peak_rss_mb()
+        rss = "n/a" if peak_rss is None else f"{peak_rss:.1f} MiB"
+
+        self.lines.append(f"Turn {self.turns}")
+        self.lines.append(
+            f"Traced memory: current {current / 1024:.1f} KiB, "
+            f"peak {peak / 1024:.1f} KiB, peak RSS {rss}"
+        )
+        self.lines.append("Live messages (delta):")
+        for name in sorted(messages | self._messages):
+            self.lines.append(
+                f"  {name}: {messages[name]} "
+                f"({messages[name] - self._messages[name]:+d})"
+            )
+        if self._snapshot is not None:
+            self.lines.append("Top allocations (delta):")
+            for stat in snapshot.compare_to(self._snapshot, "lineno")[
+                :TOP_ALLOCATIONS
+            ]:
+                self.lines.append(f"  {stat}")
+        self.lines.append("")
+
+        self._snapshot = snapshot
+        self._messages = messages
+
+    def stop(self) -> None:
+        """
+        Take a final snapshot, stop tracing allocations if this profiler
+        started it, and write the report.
+        """
+        if not self._running:
+            return
+
+        if self.turns % self.every_n_turns != 0:
+            self.take_snapshot()
+        self._running = False
+        self._snapshot = None
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        atexit.unregister(self.stop)
+
+        with open(self.report_path, "w") as f:
+            f.write("\n".join(self.lines))
@@ -0,0 +1,205 @@
+"""
+Module to run a long-session soak benchmark of the MCP client invoke loop.
+The model and tool server are replaced with fakes, so no API calls are made,
+and every few turns the fake model calls a tool to exercise the tool loop. The
+chat history is stored in a temporary database.
+
+Memory is profiled throughout by the client itself, and the benchmark fails
+if traced memory grows by more than the allowed amount per turn after the
+warm-up turns, so leaks in the invoke loop can be caught. Run using:
+```bash
+python3 -m chat_conv_fin_qa.utils.soak --turns 1000
+```
+"""
+
+from typing import Any
+from argparse import ArgumentParser
+from asyncio import run
+from contextlib import redirect_stdout
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from uuid import uuid4
+import os
+import sys
+import tracemalloc
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from mcp.types import CallToolResult, TextContent
+
+from chat_conv_fin_qa.chat_history import ChatHistory
+from chat_conv_fin_qa.mcp.client.main import MCPClient
+from chat_conv_fin_qa.model.base import BaseModel
+
+WARMUP_TURNS = 50
+DEFAULT_MAX_GROWTH_PER_TURN = 2000
+
+
+class FakeModel(BaseModel):
+    """
+    Fake model which answers immediately, calling the add tool on every N-th
+    query.
+
+    :param tool_every: Call the add tool on every N-th query.
+    :type tool_every: int
+    """
+
+    def __init__(self, tool_every: int) -> None:
+        super().__init__()
+        self._tool_every = tool_every
+        self._calls = 0
+
+    async def achat(self, messages: list[BaseMessage]) -> AIMessage:
+        """
+        Generate a fake response to the messages.
+
+        :param messages: List of messages to send to the model.
+        :type messages: list[BaseMessage]
+        :return: The fake response message.
+        :rtype: AIMessage
+        """
+        self._calls += 1
+        if (
+            isinstance(messages[-1], HumanMessage)
+            and self._calls % self._tool_every == 0
+        ):
+            return AIMessage(
+                content=[{"type": "text", "text": "Adding the numbers."}],
+                tool_calls=[
+                    {
+                        "name": "add",
+                        "args": {"a": self._calls, "b": 1},
+                        "id": f"call_{self._calls}",
+                    }
+                ],
+            )
+        return AIMessage(content=f"The answer is {self._calls}.")
+
+
+class FakeToolSession:
+    """
+    Fake MCP session which adds the arguments of any tool call.
+    """
+
+    async def call_tool(
+        self, name: str, arguments: dict[str, Any]
+    ) -> CallToolResult:
+        """
+        Call the fake tool.
+
+        :param name: The name of the tool.
+        :type name: str
+        :param arguments: The arguments to the tool.
+        :type arguments: dict[str, Any]
+        :return: The sum of the arguments.
+        :rtype: CallToolResult
+        """
+        return CallToolResult(
+            content=[
+                TextContent(type="text", text=str(sum(arguments.values())))
+            ]
+        )
+
+
+async def soak(
+    turns: int,
+    tool_every: int,
+    profile_every: int,
+    report_path: Path,
+    warmup_turns: int = WARMUP_TURNS,
+) -> float:
+    """
+    Run the soak benchmark for a single long session, profiled by the
+    client.
+
+    :param turns: The number of turns in the session, which must be greater
+        than the number of warm-up turns.
+    :type turns: int
+    :param tool_every: Call a tool on every N-th turn.
+    :type tool_every: int
+    :param profile_every: Number of turns between profiling snapshots, which
+        must be at least 1.
+    :type profile_every: int
+    :param report_path: Path to write the profiling report to.
+    :type report_path: Path
+    :param warmup_turns: The number of turns before memory growth is
+        measured.
+    :type warmup_turns: int
+    :return: The growth in traced memory per turn after warm-up, in bytes.
+    :rtype: float
+    """
+    client = MCPClient(
+        profile_every=profile_every, profile_report_path=report_path
+    )
+    client._model = FakeModel(  # type: ignore[assignment]
+        tool_every=tool_every
+    )
+    client._system_prompt = "You are a helpful assistant."
+    client.tool_sessions["add"] = FakeToolSession()  # type: ignore[assignment]
+
+    with TemporaryDirectory() as tmp_dir:
+        client.chat_history = ChatHistory(
+            url=f"sqlite:///{Path(tmp_dir) / 'soak.db'}"
+        )
+        session_id = uuid4().hex
+        start = perf_counter()
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            for turn in range(warmup_turns):
+                await client.invoke(f"What is {turn} plus 1?", session_id)
+            warmup_memory, _ = tracemalloc.get_traced_memory()
+            warmup_end = perf_counter()
+            for turn in range(warmup_turns, turns):
+                await client.invoke(f"What is {turn} plus 1?", session_id)
+        end = perf_counter()
+        end_memory, _ = tracemalloc.get_traced_memory()
+        await client.close()
+
+    measured_turns = turns - warmup_turns
+    growth = (end_memory - warmup_memory) / measured_turns
+    turn_time = (end - warmup_end) / measured_turns
+    print(f"Turns: {turns}")
+    print(f"Total time: {end - start:.2f}s")
+    print(f"Time per turn: {turn_time * 1e3:.2f}ms")
+    print(f"Traced memory growth per turn: {growth:.0f} B")
+    print(f"Profiling report written to {report_path}")
+    return growth
+
+
+def main() -> None:
+    """
+    Main function to run the soak benchmark.
+    """
+    parser = ArgumentParser(description="Soak benchmark for the MCP client.")
+    parser.add_argument("--turns", type=int, default=1000)
+    parser.add_argument("--tool-every", type=int, default=3)
+    parser.add_argument("--profile-every", type=int, default=100)
+    parser.add_argument(
+        "--report-path", type=Path, default=Path("soak_profile.txt")
+    )
+    parser.add_argument(
+        "--max-growth-per-turn",
+        type=float,
+        default=DEFAULT_MAX_GROWTH_PER_TURN,
+        help="fail if traced memory grows by more bytes than this per turn",
+    )
+    args = parser.parse_args()
+    if args.turns <= WARMUP_TURNS:
+        parser.error(f"--turns must be greater than {WARMUP_TURNS}")
+    if args.profile_every < 1:
+        parser.error("--profile-every must be at least 1")
+
+    growth = run(
+        soak(
+            turns=args.turns,
+            tool_every=args.tool_every,
+            profile_every=args.profile_every,
+            report_path=args.report_path,
+        )
+    )
+    if growth > args.max_growth_per_turn:
+        print("Memory growth per turn exceeds the allowed maximum")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""
+Tests for the batched judge scoring and conversation mode in the evaluation
+client.
+"""
+
+from typing import Any
+from pathlib import Path
+import asyncio
+import json
+
+import pytest
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.runnables import RunnableLambda
+
+from chat_conv_fin_qa.mcp.client.evaluate import EvaluateClient
+
+
+class StubJudge:
+    """
+    Stub judge which returns fixed responses for batch and single calls, and
+    records the prompts it was called with.
+
+    :param batch_response: Response to return for batch calls.
+    :type batch_response: Any
+    :param single_score: Score to return for single calls.
+    :type single_score: int
+    """
+
+    def __init__(self, batch_response: Any, single_score: int = 50) -> None:
+        self.batch_response = batch_response
+        self.single_score = single_score
+        self.batch_prompts: list[Any] = []
+        self.single_prompts: list[Any] = []
+
+    def batch(self, prompt: Any) -> Any:
+        self.batch_prompts.append(prompt)
+        return self.batch_response
+
+    def single(self, prompt: Any) -> Any:
+        self.single_prompts.append(prompt)
+        return {"score": self.single_score}
+
+
+@pytest.fixture
+def client(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> EvaluateClient:
+    monkeypatch.chdir(tmp_path)
+    return EvaluateClient(judge_batch_size=3)
+
+
+def use_judge(client: EvaluateClient, judge: StubJudge) -> None:
+    client._model_structured_batch = RunnableLambda(judge.batch)
+    client._model_structured = RunnableLambda(judge.single)
+
+
+ITEMS = {
+    "a": ("1", "1"),
+    "b": ("answer b", "reference b"),
+    "c": ("3", "3"),
+}
+
+
+def test_score_batch_rescores_only_missing_items(
+    client: EvaluateClient,
+) -> None:
+    judge = StubJudge(
+        {
+            "scores": [
+                {"id": "a", "score": 100},
+                {"id": "c", "score": 90},
+                {"id": "unknown", "score": 0},
+            ]
+        }
+    )
+    use_judge(client, judge)
+
+    scores = asyncio.run(client._score_batch(ITEMS))
+
+    assert scores == {"a": 100, "b": 50, "c": 90}
+    assert len(judge.batch_prompts) == 1
+    assert len(judge.single_prompts) == 1
+    assert "answer b" in judge.single_prompts[0]
+
+
+def test_score_batch_rescores_all_items_on_validation_error(
+    client: EvaluateClient,
+) -> None:
+    judge = StubJudge({"scores": [{"id": "a"}]})
+    use_judge(client, judge)
+
+    scores = asyncio.run(client._score_batch(ITEMS))
+
+    assert scores == {"a": 50, "b": 50, "c": 50}
+    assert len(judge.single_prompts) == 3
+
+
+def test_score_batch_ignores_unknown_ids(client: EvaluateClient) -> None:
+    judge = StubJudge(
+        {
+            "scores": [
+                {"id": "a", "score": 100},
+                {"id": "b", "score": 100},
+                {"id": "c", "score": 100},
+                {"id": "d", "score": 0},
+            ]
+        }
+    )
+    use_judge(client, judge)
+
+    scores = asyncio.run(client._score_batch(ITEMS))
+
+    assert scores == {"a": 100, "b": 100, "c": 100}
+    assert judge.single_prompts == []
+
+
+def dialogue(item_id: str, turns: int, references: int) -> dict[str, Any]:
+    return {
+        "id": item_id,
+        "pre_text": [],
+        "post_text": [],
+        "table": [],
+        "annotation": {
+            "dialogue_break": [f"question {i}" for i in range(turns)],
+            "exe_ans_list": list(range(references)),
+        },
+    }
+
+
+def test_evaluate_conversations_batches_across_dialogues(
+    client: EvaluateClient, tmp_path: Path
+) -> None:
+    (tmp_path / "data").mkdir()
+    (tmp_path / "data" / "train.json").write_text(
+        json.dumps(
+            [
+                dialogue("d0", turns=2, references=2),
+                dialogue("mismatched", turns=3, references=2),
+                dialogue("d1", turns=2, references=2),
+                dialogue("d2", turns=2, references=2),
+            ]
+        )
+    )
+    questions: list[tuple[str, str]] = []
+
+    async def invoke(query: str, session_id: str) -> AIMessage:
+        questions.append((query, session_id))
+        return AIMessage(content="0")
+
+    judged: list[list[str]] = []
+
+    def batch(prompt: Any) -> Any:
+        ids = [
+            turn_id
+            for turn_id in ("d0/0", "d0/1", "d1/0", "d1/1", "d2/0", "d2/1")
+            if f'id="{turn_id}"' in str(prompt)
+        ]
+        judged.append(ids)
+        return {"scores": [{"id": turn_id, "score": 100} for turn_id in ids]}
+
+    client.invoke = invoke  # type: ignore[method-assign]
+    client._model_structured_batch = RunnableLambda(batch)
+    asyncio.run(client.evaluate_conversations())
+
+    assert len(questions) == 6
+    assert len({session_id for _, session_id in questions}) == 3
+    assert judged == [["d0/0", "d0/1", "d1/0"], ["d1/1", "d2/0", "d2/1"]]
+
+
+class CachingModel:
+    """
+    Fake model which reports writing the system prompt to the cache on the
+    first turn of the first dialogue and reading it on the second, and no
+    cache use for later dialogues, as for a prompt too short to cache.
+    """
+
+    def __init__(self) -> None:
+        self.system_messages: list[BaseMessage] = []
+
+    async def achat(self, messages: list[BaseMessage]) -> AIMessage:
+        self.system_messages.append(messages[0])
+        calls = len(self.system_messages)
+        cache_read = 1000 if calls == 2 else 0
+        cache_creation = 1000 if calls == 1 else 0
+        return AIMessage(
+            content="0",
+            usage_metadata={
+                "input_tokens": 1200,
+                "output_tokens": 1,
+                "total_tokens": 1201,
+                "input_token_details": {
+                    "cache_read": cache_read,
+                    "cache_creation": cache_creation,
+                },
+            },
+        )
+
+
+def test_evaluate_conversations_caches_prompt_and_reports_usage(
+    client: EvaluateClient, tmp_path: Path, capsys: pytest.CaptureFixture[str]
+) -> None:
+    (tmp_path / "data").mkdir()
+    (tmp_path / "data" / "train.json").write_text(
+        json.dumps(
+            [
+                dialogue("d0", turns=2, references=2),
+                dialogue("d1", turns=2, references=2),
+            ]
+        )
+    )
+    model = CachingModel()
+    client._model = model  # type: ignore[assignment]
+    use_judge(client, StubJudge({"scores": []}))
+
+    asyncio.run(client.evaluate_conversations())
+
+    assert all(
+        message.content[0]["cache_control"]  # type: ignore[index]
+        for message in model.system_messages
+    )
+    assert isinstance(client.system_message().content, str)
+    output = capsys.readouterr().out
+    assert "Cache read tokens: 1000, cache creation tokens: 1000" in output
+    assert "Input tokens: 4800, cache read tokens: 1000" in output
+    assert "dialogues without cache reads: 1" in output
@@ -0,0 +1,329 @@
+"""
+Tests for the shared rate limiter, using a local fake provider which enforces
+a requests per window limit and a concurrency limit, raising errors with a 429
+status code like the provider clients do.
+"""
+
+from typing import Any, Optional
+from threading import Lock
+from time import monotonic, perf_counter, sleep
+import asyncio
+
+import pytest
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import Runnable, RunnableConfig
+
+from chat_conv_fin_qa.model import rate_limit
+from chat_conv_fin_qa.model.base import BaseModel
+from chat_conv_fin_qa.model.rate_limit import (
+    AdaptiveConcurrencyLimit,
+    RateLimitConfig,
+    RateLimiter,
+)
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+
+class ServiceUnavailableError(Exception):
+    status_code = 503
+
+
+class FakeProvider(Runnable[Any, Any]):
+    """
+    Fake provider which rejects requests over its limits with a 429 error.
+
+    :param max_concurrent: Maximum number of requests in flight.
+    :type max_concurrent: int
+    :param requests_per_window: Maximum number of requests per window.
+    :type requests_per_window: int
+    :param window: Length of the window in seconds.
+    :type window: float
+    :param latency: Seconds each request takes.
+    :type latency: float
+    :param fail_first: Number of initial requests to fail.
+    :type fail_first: int
+    :param fail_with: Error to fail the initial requests with.
+    :type fail_with: type[Exception]
+    :param structured: Whether to return a structured output instead of a
+        message.
+    :type structured: bool
+    """
+
+    max_tokens = 100
+
+    def __init__(
+        self,
+        max_concurrent: int = 100,
+        requests_per_window: int = 1000,
+        window: float = 1.0,
+        latency: float = 0.0,
+        fail_first: int = 0,
+        fail_with: type[Exception] = RateLimitError,
+        structured: bool = False,
+    ) -> None:
+        self.max_concurrent = max_concurrent
+        self.requests_per_window = requests_per_window
+        self.window = window
+        self.latency = latency
+        self.fail_first = fail_first
+        self.fail_with = fail_with
+        self.structured = structured
+        self.calls = 0
+        self.rejected = 0
+        self.in_flight = 0
+        self._times: list[float] = []
+        self._lock = Lock()
+
+    def _start(self) -> None:
+        with self._lock:
+            self.calls += 1
+            now = monotonic()
+            self._times = [t for t in self._times if now - t < self.window]
+            if self.calls <= self.fail_first:
+                raise self.fail_with("Request failed")
+            if (
+                self.in_flight >= self.max_concurrent
+                or len(self._times) >= self.requests_per_window
+            ):
+                self.rejected += 1
+                raise RateLimitError("429 Too Many Requests")
+            self.in_flight += 1
+            self._times.append(now)
+
+    def _finish(self) -> Any:
+        with self._lock:
+            self.in_flight -= 1
+        if self.structured:
+            return {"score": 100}
+        return AIMessage(
+            content="ok",
+            usage_metadata={
+                "input_tokens": 5,
+                "output_tokens": 2,
+                "total_tokens": 7,
+            },
+        )
+
+    def invoke(
+        self,
+        input: Any,
+        config: Optional[RunnableConfig] = None,
+        **kwargs: Any,
+    ) -> Any:
+        self._start()
+        sleep(self.latency)
+        return self._finish()
+
+    async def ainvoke(
+        self,
+        input: Any,
+        config: Optional[RunnableConfig] = None,
+        **kwargs: Any,
+    ) -> Any:
+        self._start()
+        await asyncio.sleep(self.latency)
+        return self._finish()
+
+
+def make_limiter(**kwargs: Any) -> RateLimiter:
+    config: dict[str, Any] = {
+        "requests_per_minute": 6000,
+        "input_tokens_per_minute": 1e6,
+        "output_tokens_per_minute": 1e6,
+        "retry_backoff": 0.0,
+    }
+    config.update(kwargs)
+    return RateLimiter(RateLimitConfig(**config))
+
+
+def make_model(provider: FakeProvider, limiter: RateLimiter) -> BaseModel:
+    model = BaseModel(rate_limiter=limiter)
+    model._model = provider  # type: ignore[assignment]
+    return model
+
+
+def test_limit_halves_on_rate_limit_and_grows_on_success() -> None:
+    concurrency = AdaptiveConcurrencyLimit(initial_limit=8)
+
+    concurrency.acquire()
+    concurrency.release(success=False)
+    assert concurrency.limit == 4
+
+    concurrency.acquire()
+    concurrency.release(success=True)
+    assert concurrency.limit == 4.25
+    assert concurrency.in_flight == 0
+
+
+def test_retries_stop_at_max_retries() -> None:
+    provider = FakeProvider(max_concurrent=0)
+    limiter = make_limiter(initial_concurrency=8, max_retries=2)
+    model = make_model(provider, limiter)
+
+    with pytest.raises(RateLimitError):
+        model._call(provider, "hello")
+
+    assert provider.calls == 3
+    assert limiter.concurrency.limit == 1
+    assert limiter.concurrency.in_flight == 0
+
+
+def test_retries_rate_limit_error_until_success() -> None:
+    provider = FakeProvider(fail_first=1)
+    limiter = make_limiter(initial_concurrency=4)
+    model = make_model(provider, limiter)
+
+    result = model._call(provider, "hello")
+
+    assert result.content == "ok"
+    assert provider.calls == 2
+    assert limiter.concurrency.limit == 2.5
+
+
+def test_limit_unchanged_on_transient_errors() -> None:
+    provider = FakeProvider(fail_first=4, fail_with=ServiceUnavailableError)
+    limiter = make_limiter(initial_concurrency=4, max_retries=3)
+    model = make_model(provider, limiter)
+
+    with pytest.raises(ServiceUnavailableError):
+        model._call(provider, "hello")
+
+    assert provider.calls == 4
+    assert limiter.concurrency.limit == 4
+    assert limiter.concurrency.in_flight == 0
+
+
+def test_combined_token_limit_shares_one_bucket() -> None:
+    limiter = make_limiter(
+        input_tokens_per_minute=None,
+        output_tokens_per_minute=None,
+        tokens_per_minute=10_000,
+    )
+
+    assert limiter.input_tokens is limiter.output_tokens
+    assert limiter._reserve(6_000, 0) == 0
+    assert limiter._reserve(0, 6_000) > 0
+
+
+def test_config_limits_read_from_env(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("PROVIDER_REQUESTS_PER_MINUTE", "4000")
+    monkeypatch.setenv("PROVIDER_MAX_RETRIES", "5")
+
+    config = RateLimitConfig.from_env(
+        "PROVIDER", requests_per_minute=50, tokens_per_minute=30_000
+    )
+
+    assert config.requests_per_minute == 4000
+    assert config.max_retries == 5
+    assert config.tokens_per_minute == 30_000
+
+
+def test_sync_acquire_respects_request_bucket() -> None:
+    provider = FakeProvider()
+    limiter = make_limiter(requests_per_minute=600)
+    limiter.requests.reserve(600)
+    model = make_model(provider, limiter)
+
+    start = perf_counter()
+    for _ in range(3):
+        model._call(provider, "hello")
+
+    assert perf_counter() - start >= 0.25
+
+
+def test_async_acquire_respects_request_bucket() -> None:
+    provider = FakeProvider()
+    limiter = make_limiter(requests_per_minute=600)
+    limiter.requests.reserve(600)
+    model = make_model(provider, limiter)
+
+    async def run() -> None:
+        await asyncio.gather(
+            *(model._acall(provider, "hello") for _ in range(3))
+        )
+
+    start = perf_counter()
+    asyncio.run(run())
+
+    assert perf_counter() - start >= 0.25
+
+
+def test_async_calls_adapt_to_provider_concurrency() -> None:
+    provider = FakeProvider(max_concurrent=2, latency=0.02)
+    limiter = make_limiter(initial_concurrency=8, max_retries=10)
+    model = make_model(provider, limiter)
+
+    async def run() -> list[Any]:
+        return await asyncio.gather(
+            *(model._acall(provider, "hello") for _ in range(30))
+        )
+
+    results = asyncio.run(run())
+
+    assert all(result.content == "ok" for result in results)
+    assert limiter.concurrency.limit < 8
+    assert limiter.concurrency.in_flight == 0
+
+
+def test_request_bucket_stays_within_provider_rate() -> None:
+    provider = FakeProvider(requests_per_window=5, window=1.0)
+    limiter = make_limiter(requests_per_minute=240, max_retries=0)
+    limiter.requests.reserve(240)
+    model = make_model(provider, limiter)
+
+    async def run() -> None:
+        await asyncio.gather(
+            *(model._acall(provider, "hello") for _ in range(6))
+        )
+
+    asyncio.run(run())
+
+    assert provider.rejected == 0
+
+
+def test_cancelled_async_acquire_returns_slot() -> None:
+    limiter = make_limiter(requests_per_minute=60)
+    limiter.requests.reserve(60)
+
+    async def run() -> None:
+        task = asyncio.create_task(limiter.acquire_async(1, 1))
+        await asyncio.sleep(0.05)
+        assert limiter.concurrency.in_flight == 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+
+    assert limiter.concurrency.in_flight == 0
+    assert limiter.requests.reserve(0) < 0.1
+
+
+def test_interrupted_sync_acquire_returns_slot(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    def interrupt(seconds: float) -> None:
+        raise KeyboardInterrupt
+
+    limiter = make_limiter()
+    monkeypatch.setattr(rate_limit, "sleep", interrupt)
+
+    with pytest.raises(KeyboardInterrupt):
+        limiter.acquire(1, 1)
+
+    assert limiter.concurrency.in_flight == 0
+
+
+def test_output_tokens_reserved_and_corrected() -> None:
+    limiter = make_limiter(output_tokens_per_minute=10_000)
+
+    structured = FakeProvider(structured=True)
+    make_model(structured, limiter)._call(structured, "hello")
+    assert limiter.output_tokens.reserve(0) == 0
+    assert 9_895 <= limiter.output_tokens._available <= 9_905
+
+    chat = FakeProvider()
+    make_model(chat, limiter)._call(chat, "hello")
+    assert 9_893 <= limiter.output_tokens._available <= 9_903
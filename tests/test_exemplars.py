@@ -0,0 +1,126 @@
+"""
+Tests for the few-shot exemplar index.
+"""
+
+from pathlib import Path
+import json
+
+import numpy as np
+import pytest
+
+from chat_conv_fin_qa.exemplars import ExemplarIndex
+
+
+@pytest.fixture
+def data_path(tmp_path: Path) -> Path:
+    questions = [
+        "what is the total?",
+        "what is the total?",
+        "what is the total?",
+        "what was the percent change in net income?",
+        "what was the change in revenue from 2008 to 2009?",
+        "what is the total of operating expenses?",
+    ]
+    data = [
+        {
+            "id": f"item_{i}",
+            "qa": {
+                "question": question,
+                "program": f"add({i}, 1)",
+                "answer": i + 1,
+            },
+        }
+        for i, question in enumerate(questions)
+    ]
+    path = tmp_path / "train.json"
+    path.write_text(json.dumps(data))
+    return path
+
+
+def test_query_returns_most_similar_first(data_path: Path) -> None:
+    index = ExemplarIndex.build(data_path=data_path)
+
+    exemplars = index.query("percent change in net income", k=2)
+
+    assert exemplars[0].id == "item_3"
+    assert len(exemplars) == 2
+
+
+def test_query_excludes_by_id_and_still_returns_k(data_path: Path) -> None:
+    index = ExemplarIndex.build(data_path=data_path)
+
+    exemplars = index.query("what is the total?", k=3, exclude={"item_0"})
+
+    assert len(exemplars) == 3
+    assert "item_0" not in {exemplar.id for exemplar in exemplars}
+    assert {"item_1", "item_2"} <= {exemplar.id for exemplar in exemplars}
+
+
+def test_query_skips_exemplars_with_no_similarity(data_path: Path) -> None:
+    index = ExemplarIndex.build(data_path=data_path)
+
+    assert not index.query("zzz qqq", k=3)
+    assert not index.format_exemplars("zzz qqq", k=3)
+    assert len(index.query("net income", k=6)) == 1
+
+
+def test_load_or_build_uses_memory_mapped_cache(
+    data_path: Path, tmp_path: Path
+) -> None:
+    index_path = tmp_path / "exemplar_index"
+    built = ExemplarIndex.load_or_build(
+        data_path=data_path, index_path=index_path
+    )
+    loaded = ExemplarIndex.load_or_build(
+        data_path=data_path, index_path=index_path
+    )
+
+    assert isinstance(loaded._data, np.memmap)
+    assert loaded.exemplars == built.exemplars
+    assert loaded.query("net income", k=2) == built.query("net income", k=2)
+
+
+def test_load_or_build_rebuilds_when_data_changes(
+    data_path: Path, tmp_path: Path
+) -> None:
+    index_path = tmp_path / "exemplar_index"
+    ExemplarIndex.load_or_build(data_path=data_path, index_path=index_path)
+    data = json.loads(data_path.read_text())
+    data[0]["qa"]["question"] = "what was the net revenue?"
+    data_path.write_text(json.dumps(data))
+
+    rebuilt = ExemplarIndex.load_or_build(
+        data_path=data_path, index_path=index_path
+    )
+
+    assert not isinstance(rebuilt._data, np.memmap)
+    assert rebuilt.exemplars[0].question == "what was the net revenue?"
+
+
+def test_load_or_build_rebuilds_for_other_data_path(
+    data_path: Path, tmp_path: Path
+) -> None:
+    index_path = tmp_path / "exemplar_index"
+    ExemplarIndex.load_or_build(data_path=data_path, index_path=index_path)
+    other_path = tmp_path / "other.json"
+    other_path.write_text(json.dumps(json.loads(data_path.read_text())[:2]))
+
+    rebuilt = ExemplarIndex.load_or_build(
+        data_path=other_path, index_path=index_path
+    )
+
+    assert len(rebuilt.exemplars) == 2
+
+
+def test_load_or_build_rebuilds_when_settings_change(
+    data_path: Path, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    index_path = tmp_path / "exemplar_index"
+    ExemplarIndex.load_or_build(data_path=data_path, index_path=index_path)
+    monkeypatch.setattr("chat_conv_fin_qa.exemplars.NGRAM_RANGE", (1, 3))
+
+    rebuilt = ExemplarIndex.load_or_build(
+        data_path=data_path, index_path=index_path
+    )
+
+    assert not isinstance(rebuilt._data, np.memmap)
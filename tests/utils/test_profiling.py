@@ -0,0 +1,26 @@
+"""
+Tests for the session memory profiler.
+"""
+
+from pathlib import Path
+import sys
+
+import pytest
+
+from chat_conv_fin_qa.utils.profiling import SessionProfiler, peak_rss_mb
+
+
+def test_peak_rss_unavailable_without_resource_module(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setitem(sys.modules, "resource", None)
+    profiler = SessionProfiler(
+        every_n_turns=1, report_path=tmp_path / "profile.txt"
+    )
+
+    profiler.start()
+    profiler.record_turn()
+    profiler.stop()
+
+    assert peak_rss_mb() is None
+    assert "peak RSS n/a" in (tmp_path / "profile.txt").read_text()
@@ -0,0 +1,35 @@
+"""
+Tests for the soak benchmark, running a short session through the client with
+memory profiling enabled. The full threshold check is left to the benchmark
+itself, as the memory used per turn varies between library versions.
+"""
+
+from pathlib import Path
+import asyncio
+import tracemalloc
+
+from chat_conv_fin_qa.utils.soak import soak
+
+TURNS = 60
+WARMUP_TURNS = 20
+# Well above the growth of a healthy session, but catches leaks of whole
+# objects per turn, such as a SQLAlchemy model declared for every history.
+MAX_GROWTH_PER_TURN = 20_000
+
+
+def test_short_soak_memory_growth_within_threshold(tmp_path: Path) -> None:
+    report_path = tmp_path / "soak_profile.txt"
+
+    growth = asyncio.run(
+        soak(
+            turns=TURNS,
+            tool_every=3,
+            profile_every=TURNS,
+            report_path=report_path,
+            warmup_turns=WARMUP_TURNS,
+        )
+    )
+
+    assert growth < MAX_GROWTH_PER_TURN
+    assert f"Turn {TURNS}" in report_path.read_text()
+    assert not tracemalloc.is_tracing()